@@ -4,20 +4,97 @@ Automated Homework Grading System
 Leverages PaddleOCR output to grade handwritten homework against teacher's answer key
 """
 
-import json
+import os
 import re
 import numpy as np
+import orjson
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import Dict, List, Tuple, Any, Optional
-from dataclasses import dataclass
-from difflib import SequenceMatcher
+from dataclasses import dataclass, field
+from rapidfuzz.fuzz import ratio as _rf_ratio
+from rapidfuzz.process import cpdist
 import logging
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-@dataclass
+# Precompiled patterns used on every OCR token
+_CLEAN_RE = re.compile(r'[^\w\s\.\-\+\=\:\/\(\)\[\]\{\}]')
+_WS_RE = re.compile(r'\s+')
+_HAS_DIGIT_RE = re.compile(r'\d')
+_QUESTION_RE = re.compile('|'.join(map(re.escape, [
+    '填空', '解比例', '应用题', '拓展题', '基础练习', '提高练习'
+])))
+
+# Lowest similarity (in percent) that can earn credit; rapidfuzz returns 0 below it
+# and can reject far-apart strings, e.g. by length, without scoring them fully
+_SIM_CUTOFF = 60
+# Most (student, expected) similarity pairs kept per grader, like the lru_cache sizes below
+_SIM_CACHE_SIZE = 4096
+
+# Compact codes for Question.answer_type used in the template arrays
+_ANSWER_TYPE_CODES = {'numeric': 0, 'formula': 1, 'text': 2}
+_GENERAL_TYPE_CODE = 3
+
+# Feedback messages shared by every grading result
+_FB_NO_NUMBER = "No numeric answer found"
+_FB_UNPARSEABLE = "Could not parse numeric answer"
+_FB_CORRECT = "Correct!"
+_FB_CORRECT_FORMULA = "Correct formula!"
+_FB_CORRECT_ANSWER = "Correct answer!"
+_FB_NO_ANSWER = "No answer detected"
+
+# Deletion table for answer-shaped ASCII characters (digits and math symbols)
+_ANSWER_CHARS = str.maketrans('', '', '0123456789.-+=:/()[]{}')
+# Same check for non-ASCII text, where \d also covers e.g. full-width digits
+_ONLY_SYMBOLS_RE = re.compile(r'^[\d\.\-\+\=\:\/\(\)\[\]\{\}]+$')
+
+def _parse_first_number(text: str) -> Optional[float]:
+    """Parse the first run of digits and dots in text, or None if there is none.
+    
+    Equivalent to float(re.findall(r'[\d\.]+', text)[0]) without the regex;
+    raises ValueError for runs like '.' or '1.2.3'.
+    """
+    n = len(text)
+    i = 0
+    while i < n and not (text[i] == '.' or text[i].isdecimal()):
+        i += 1
+    if i == n:
+        return None
+    j = i + 1
+    while j < n and (text[j] == '.' or text[j].isdecimal()):
+        j += 1
+    return float(text[i:j])
+
+def grade_numeric_batch(student_vals: np.ndarray, expected_vals: np.ndarray,
+                        tol: np.ndarray, points: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Grade many numeric answers at once.
+    
+    Returns a boolean array of answers within tolerance and the points earned for each.
+    """
+    correct = np.abs(student_vals - expected_vals) <= tol
+    earned = np.where(correct, points, 0.0)
+    return correct, earned
+
+def _format_similarity(similarity: float) -> str:
+    """Similarity for feedback; scores under the cutoff are not computed exactly"""
+    if similarity * 100 < _SIM_CUTOFF:
+        return f"<{_SIM_CUTOFF / 100:.2f}"
+    return f"{similarity:.2f}"
+
+@lru_cache(maxsize=4096)
+def _normalize_formula(formula: str) -> str:
+    """Normalize mathematical formulas for comparison"""
+    # Remove spaces and convert to lowercase
+    formula = _WS_RE.sub('', formula.lower())
+    # Normalize common mathematical symbols
+    formula = formula.replace('×', '*').replace('÷', '/')
+    return formula
+
+@dataclass(slots=True)
 class Question:
     """Represents a question with its expected answer and scoring criteria"""
     question_id: str
@@ -27,8 +104,11 @@ class Question:
     points: float
     tolerance: float = 0.1  # For numeric answers
     partial_credit: bool = True
+    # Grader-side caches of the expected answer, filled by _prepare_question
+    _normalized_answer: Optional[str] = field(default=None, init=False, repr=False, compare=False)
+    _expected_value: Optional[float] = field(default=None, init=False, repr=False, compare=False)
 
-@dataclass
+@dataclass(slots=True)
 class StudentAnswer:
     """Represents a student's answer to a question"""
     question_id: str
@@ -37,7 +117,7 @@ class StudentAnswer:
     bounding_box: List[int]
     is_handwritten: bool = True
 
-@dataclass
+@dataclass(slots=True)
 class GradingResult:
     """Represents the grading result for a student"""
     student_id: str
@@ -51,6 +131,7 @@ class HomeworkGradingSystem:
     """Main class for automated homework grading"""
     
     def __init__(self, template_path: str = None):
+        self._sim_cache: Dict[Tuple[str, str], float] = {}
         self.template = self._load_template(template_path) if template_path else None
         self.ocr_results = {}
         
@@ -73,63 +154,92 @@ class HomeworkGradingSystem:
             "4": Question("4", "应用题", "7.5", "numeric", 6.0),
             "5": Question("5", "拓展题", "甲:96袋,乙:72袋", "text", 8.0)
         }
+        for question in template.values():
+            self._prepare_question(question)
         return template
     
+    def _prepare_question(self, question: Question) -> Question:
+        """Cache the normalized expected answer so it is not recomputed per student"""
+        if question._normalized_answer is not None:
+            return question
+        
+        question._normalized_answer = self._normalize_formula(question.expected_answer)
+        if question.answer_type == 'numeric':
+            try:
+                question._expected_value = _parse_first_number(question.expected_answer)
+            except ValueError:
+                question._expected_value = None
+        return question
+    
+    def _template_arrays(self) -> Dict[str, Any]:
+        """Per-question arrays of the current template, built once per batch"""
+        questions = [self._prepare_question(q) for q in self.template.values()]
+        return {
+            'index': {question_id: i for i, question_id in enumerate(self.template)},
+            'points': np.array([q.points for q in questions], dtype=np.float64),
+            'expected_num': np.array([np.nan if q._expected_value is None else q._expected_value
+                                      for q in questions], dtype=np.float64),
+            'tol': np.array([q.tolerance for q in questions], dtype=np.float64),
+            'type': np.array([_ANSWER_TYPE_CODES.get(q.answer_type, _GENERAL_TYPE_CODE)
+                              for q in questions], dtype=np.uint8),
+        }
+    
     def load_ocr_result(self, json_path: str) -> Dict[str, Any]:
         """Load OCR result from JSON file"""
-        with open(json_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        with open(json_path, 'rb') as f:
+            return orjson.loads(f.read())
     
     def extract_answers_from_ocr(self, ocr_result: Dict[str, Any]) -> List[StudentAnswer]:
         """Extract student answers from OCR result"""
-        answers = []
-        
         # Get text and confidence scores
         texts = ocr_result.get('rec_texts', [])
         scores = ocr_result.get('rec_scores', [])
         boxes = ocr_result.get('rec_boxes', [])
+        n = min(len(texts), len(scores), len(boxes))
+        
+        # Clean every token once
+        cleaned = [_CLEAN_RE.sub('', text).strip() for text in texts[:n]]
         
         # Filter for handwritten answers (typically lower confidence scores)
-        # and answers that appear to be responses (numbers, formulas, etc.)
-        for i, (text, score, box) in enumerate(zip(texts, scores, boxes)):
-            # Clean the text
-            cleaned_text = self._clean_text(text)
-            
-            # Skip if text is too short or appears to be question text
-            if len(cleaned_text) < 2 or self._is_question_text(cleaned_text):
-                continue
-                
-            # Check if this looks like an answer
-            if self._looks_like_answer(cleaned_text):
-                answer = StudentAnswer(
-                    question_id=f"answer_{i}",
-                    extracted_text=cleaned_text,
-                    confidence_score=score,
-                    bounding_box=box,
-                    is_handwritten=True
-                )
-                answers.append(answer)
-        
-        return answers
+        # and answers that appear to be responses (numbers, formulas, etc.),
+        # skipping text that is too short or appears to be question text
+        mask = np.fromiter(
+            (len(c) >= 2 and _QUESTION_RE.search(c) is None and self._looks_like_answer(c)
+             for c in cleaned),
+            dtype=bool, count=n)
+        
+        # Only build StudentAnswer objects for the surviving tokens
+        return [
+            StudentAnswer(
+                question_id=f"answer_{i}",
+                extracted_text=cleaned[i],
+                confidence_score=scores[i],
+                bounding_box=boxes[i],
+                is_handwritten=True
+            )
+            for i in np.flatnonzero(mask).tolist()
+        ]
     
     def _clean_text(self, text: str) -> str:
         """Clean OCR text for better comparison"""
         # Remove common OCR artifacts
-        text = re.sub(r'[^\w\s\.\-\+\=\:\/\(\)\[\]\{\}]', '', text)
+        text = _CLEAN_RE.sub('', text)
         text = text.strip()
         return text
     
     def _is_question_text(self, text: str) -> bool:
         """Check if text appears to be question text rather than answer"""
-        question_indicators = ['填空', '解比例', '应用题', '拓展题', '基础练习', '提高练习']
-        return any(indicator in text for indicator in question_indicators)
+        return _QUESTION_RE.search(text) is not None
     
     def _looks_like_answer(self, text: str) -> bool:
         """Check if text looks like a mathematical answer"""
         # Look for numbers, mathematical symbols, or short responses
-        if re.match(r'^[\d\.\-\+\=\:\/\(\)\[\]\{\}]+$', text):
+        if text.isascii():
+            if text and not text.translate(_ANSWER_CHARS):
+                return True
+        elif _ONLY_SYMBOLS_RE.match(text):
             return True
-        if len(text) <= 10 and any(char.isdigit() for char in text):
+        if len(text) <= 10 and _HAS_DIGIT_RE.search(text):
             return True
         return False
     
@@ -138,8 +248,9 @@ class HomeworkGradingSystem:
         """Align extracted answers with template questions based on spatial position"""
         aligned_answers = {}
         
-        # Sort answers by vertical position (top to bottom)
-        sorted_answers = sorted(answers, key=lambda x: x.bounding_box[1])
+        # Sort answers by vertical position (top to bottom); stable, like sorted()
+        tops = np.fromiter((a.bounding_box[1] for a in answers), dtype=np.float64, count=len(answers))
+        sorted_answers = [answers[i] for i in np.argsort(tops, kind='stable')]
         
         # Simple alignment based on position - in practice, you'd want more sophisticated logic
         question_ids = list(template.keys())
@@ -151,8 +262,12 @@ class HomeworkGradingSystem:
         return aligned_answers
     
     def grade_answer(self, student_answer: StudentAnswer, 
-                    expected_question: Question) -> Dict[str, Any]:
+                    expected_question: Question,
+                    similarity: Optional[float] = None,
+                    numeric_grade: Optional[Tuple[float, bool, float]] = None) -> Dict[str, Any]:
         """Grade a single answer against the expected answer"""
+        self._prepare_question(expected_question)
+        
         result = {
             'question_id': expected_question.question_id,
             'expected_answer': expected_question.expected_answer,
@@ -164,113 +279,146 @@ class HomeworkGradingSystem:
             'feedback': []
         }
         
+        # Similarity may already have been computed in a batch (see batch_grade)
+        if expected_question.answer_type != 'numeric' and similarity is None:
+            similarity = self._similarity(*self._similarity_pair(student_answer, expected_question))
+        
         # Different grading logic based on answer type
         if expected_question.answer_type == 'numeric':
-            result = self._grade_numeric_answer(student_answer, expected_question, result)
+            result = self._grade_numeric_answer(student_answer, expected_question, result, numeric_grade)
         elif expected_question.answer_type == 'formula':
-            result = self._grade_formula_answer(student_answer, expected_question, result)
+            result = self._grade_formula_answer(student_answer, expected_question, result, similarity)
         elif expected_question.answer_type == 'text':
-            result = self._grade_text_answer(student_answer, expected_question, result)
+            result = self._grade_text_answer(student_answer, expected_question, result, similarity)
         else:
-            result = self._grade_general_answer(student_answer, expected_question, result)
+            result = self._grade_general_answer(student_answer, expected_question, result, similarity)
         
         return result
     
     def _grade_numeric_answer(self, student_answer: StudentAnswer, 
-                            expected_question: Question, result: Dict[str, Any]) -> Dict[str, Any]:
+                            expected_question: Question, result: Dict[str, Any],
+                            numeric_grade: Optional[Tuple[float, bool, float]] = None) -> Dict[str, Any]:
         """Grade numeric answers with tolerance"""
-        try:
-            # Extract numbers from student answer
-            student_numbers = re.findall(r'[\d\.]+', student_answer.extracted_text)
-            expected_numbers = re.findall(r'[\d\.]+', expected_question.expected_answer)
-            
-            if not student_numbers:
-                result['feedback'].append("No numeric answer found")
-                return result
-            
-            # Compare numbers with tolerance
-            student_value = float(student_numbers[0])
-            expected_value = float(expected_numbers[0])
-            
-            if abs(student_value - expected_value) <= expected_question.tolerance:
-                result['is_correct'] = True
-                result['points_earned'] = expected_question.points
-                result['feedback'].append("Correct!")
-            else:
-                result['feedback'].append(f"Expected {expected_value}, got {student_value}")
+        if numeric_grade is not None:
+            # Already compared in a batch (see batch_grade)
+            student_value, is_correct, points_earned = numeric_grade
+        else:
+            try:
+                # Extract the first number from student answer
+                student_value = _parse_first_number(student_answer.extracted_text)
+                
+                if student_value is None:
+                    result['feedback'].append(_FB_NO_NUMBER)
+                    return result
                 
-        except (ValueError, IndexError):
-            result['feedback'].append("Could not parse numeric answer")
+                # Compare numbers with tolerance
+                expected_value = expected_question._expected_value
+                if expected_value is None:
+                    raise ValueError("expected answer is not numeric")
+                
+                is_correct = abs(student_value - expected_value) <= expected_question.tolerance
+                points_earned = expected_question.points if is_correct else 0.0
+                    
+            except (ValueError, IndexError):
+                result['feedback'].append(_FB_UNPARSEABLE)
+                return result
+        
+        if is_correct:
+            result['is_correct'] = True
+            result['points_earned'] = points_earned
+            result['feedback'].append(_FB_CORRECT)
+        else:
+            result['feedback'].append(f"Expected {expected_question._expected_value}, got {student_value}")
         
         return result
     
     def _grade_formula_answer(self, student_answer: StudentAnswer, 
-                            expected_question: Question, result: Dict[str, Any]) -> Dict[str, Any]:
+                            expected_question: Question, result: Dict[str, Any],
+                            similarity: float) -> Dict[str, Any]:
         """Grade formula answers using similarity matching"""
-        # Normalize formulas for comparison
-        student_formula = self._normalize_formula(student_answer.extracted_text)
-        expected_formula = self._normalize_formula(expected_question.expected_answer)
-        
-        # Calculate similarity
-        similarity = SequenceMatcher(None, student_formula, expected_formula).ratio()
-        
         if similarity >= 0.8:  # 80% similarity threshold
             result['is_correct'] = True
             result['points_earned'] = expected_question.points
-            result['feedback'].append("Correct formula!")
+            result['feedback'].append(_FB_CORRECT_FORMULA)
         elif similarity >= 0.6 and expected_question.partial_credit:
             result['points_earned'] = expected_question.points * 0.5
             result['feedback'].append(f"Partially correct (similarity: {similarity:.2f})")
         else:
-            result['feedback'].append(f"Formula doesn't match (similarity: {similarity:.2f})")
+            result['feedback'].append(f"Formula doesn't match (similarity: {_format_similarity(similarity)})")
         
         return result
     
     def _grade_text_answer(self, student_answer: StudentAnswer, 
-                          expected_question: Question, result: Dict[str, Any]) -> Dict[str, Any]:
+                          expected_question: Question, result: Dict[str, Any],
+                          similarity: float) -> Dict[str, Any]:
         """Grade text answers using similarity matching"""
-        similarity = SequenceMatcher(None, 
-                                   student_answer.extracted_text.lower(),
-                                   expected_question.expected_answer.lower()).ratio()
-        
         if similarity >= 0.8:
             result['is_correct'] = True
             result['points_earned'] = expected_question.points
-            result['feedback'].append("Correct answer!")
+            result['feedback'].append(_FB_CORRECT_ANSWER)
         elif similarity >= 0.6 and expected_question.partial_credit:
             result['points_earned'] = expected_question.points * 0.5
             result['feedback'].append(f"Partially correct (similarity: {similarity:.2f})")
         else:
-            result['feedback'].append(f"Answer doesn't match (similarity: {similarity:.2f})")
+            result['feedback'].append(f"Answer doesn't match (similarity: {_format_similarity(similarity)})")
         
         return result
     
     def _grade_general_answer(self, student_answer: StudentAnswer, 
-                            expected_question: Question, result: Dict[str, Any]) -> Dict[str, Any]:
+                            expected_question: Question, result: Dict[str, Any],
+                            similarity: float) -> Dict[str, Any]:
         """General grading for other answer types"""
-        similarity = SequenceMatcher(None, 
-                                   student_answer.extracted_text,
-                                   expected_question.expected_answer).ratio()
-        
         if similarity >= 0.8:
             result['is_correct'] = True
             result['points_earned'] = expected_question.points
         elif similarity >= 0.6 and expected_question.partial_credit:
             result['points_earned'] = expected_question.points * 0.5
         
-        result['feedback'].append(f"Similarity score: {similarity:.2f}")
+        result['feedback'].append(f"Similarity score: {_format_similarity(similarity)}")
         return result
     
+    def _similarity_pair(self, student_answer: StudentAnswer,
+                         expected_question: Question) -> Tuple[str, str]:
+        """Return the (student, expected) strings compared for non-numeric answers"""
+        if expected_question.answer_type == 'formula':
+            # Normalize formulas for comparison
+            return (self._normalize_formula(student_answer.extracted_text),
+                    expected_question._normalized_answer)
+        elif expected_question.answer_type == 'text':
+            return (student_answer.extracted_text.lower(),
+                    expected_question.expected_answer.lower())
+        return student_answer.extracted_text, expected_question.expected_answer
+    
+    def _similarity(self, student_text: str, expected_text: str) -> float:
+        """Similarity ratio between two strings in [0, 1]"""
+        # Exact matches are common after normalization and need no scoring
+        if student_text == expected_text:
+            return 1.0
+        key = (student_text, expected_text)
+        similarity = self._sim_cache.get(key)
+        if similarity is None:
+            similarity = _rf_ratio(student_text, expected_text, score_cutoff=_SIM_CUTOFF) / 100.0
+            self._cache_similarity(key, similarity)
+        return similarity
+    
+    def _cache_similarity(self, key: Tuple[str, str], similarity: float):
+        """Remember a similarity, starting over once the cache is full"""
+        if len(self._sim_cache) >= _SIM_CACHE_SIZE:
+            self._sim_cache.clear()
+        self._sim_cache[key] = similarity
+    
     def _normalize_formula(self, formula: str) -> str:
         """Normalize mathematical formulas for comparison"""
-        # Remove spaces and convert to lowercase
-        formula = re.sub(r'\s+', '', formula.lower())
-        # Normalize common mathematical symbols
-        formula = formula.replace('×', '*').replace('÷', '/')
-        return formula
+        return _normalize_formula(formula)
     
     def grade_homework(self, student_id: str, ocr_result: Dict[str, Any]) -> GradingResult:
         """Grade a complete homework assignment"""
+        # A single page is too small for the batched path to pay off
+        aligned_answers = self._extract_aligned_answers(ocr_result)
+        return self._grade_aligned_answers(student_id, aligned_answers)
+    
+    def _extract_aligned_answers(self, ocr_result: Dict[str, Any]) -> Dict[str, StudentAnswer]:
+        """Extract student answers from OCR and align them with the template"""
         if not self.template:
             raise ValueError("Template not loaded. Please load teacher's answer key first.")
         
@@ -278,7 +426,15 @@ class HomeworkGradingSystem:
         answers = self.extract_answers_from_ocr(ocr_result)
         
         # Align answers with questions
-        aligned_answers = self.align_answers_with_questions(answers, self.template)
+        return self.align_answers_with_questions(answers, self.template)
+    
+    def _grade_aligned_answers(self, student_id: str, aligned_answers: Dict[str, StudentAnswer],
+                               similarities: Optional[Dict[str, float]] = None,
+                               numeric_grades: Optional[Dict[str, Tuple[float, bool, float]]] = None
+                               ) -> GradingResult:
+        """Grade answers already aligned with the template questions"""
+        similarities = similarities or {}
+        numeric_grades = numeric_grades or {}
         
         # Grade each answer
         question_results = []
@@ -287,7 +443,9 @@ class HomeworkGradingSystem:
         
         for question_id, expected_question in self.template.items():
             if question_id in aligned_answers:
-                result = self.grade_answer(aligned_answers[question_id], expected_question)
+                result = self.grade_answer(aligned_answers[question_id], expected_question,
+                                           similarities.get(question_id),
+                                           numeric_grades.get(question_id))
             else:
                 result = {
                     'question_id': question_id,
@@ -297,7 +455,7 @@ class HomeworkGradingSystem:
                     'points_earned': 0.0,
                     'max_points': expected_question.points,
                     'is_correct': False,
-                    'feedback': ['No answer detected']
+                    'feedback': [_FB_NO_ANSWER]
                 }
             
             question_results.append(result)
@@ -324,66 +482,196 @@ class HomeworkGradingSystem:
     def batch_grade(self, ocr_results_dir: str) -> List[GradingResult]:
         """Grade multiple homework assignments"""
         results = []
-        ocr_dir = Path(ocr_results_dir)
+        aligned_by_student = []
         
-        for json_file in ocr_dir.glob("*_res.json"):
-            if "homework1" in json_file.name:  # Skip teacher's answer key
-                continue
-                
+        # Single directory scan; DirEntry names need no further stat calls
+        with os.scandir(ocr_results_dir) as entries:
+            json_files = [Path(e.path) for e in entries
+                          if e.name.endswith("_res.json")
+                          and "homework1" not in e.name]  # Skip teacher's answer key
+        
+        # Load OCR results concurrently to overlap file reads with JSON parsing
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            futures = [executor.submit(self.load_ocr_result, str(f)) for f in json_files]
+        
+        for json_file, future in zip(json_files, futures):
             student_id = json_file.stem.replace("_res", "")
             logger.info(f"Grading {student_id}...")
             
             try:
-                ocr_result = self.load_ocr_result(str(json_file))
-                result = self.grade_homework(student_id, ocr_result)
+                ocr_result = future.result()
+                aligned_by_student.append((student_id, self._extract_aligned_answers(ocr_result)))
+            except Exception as e:
+                logger.error(f"Error grading {student_id}: {e}")
+        
+        # Score the whole cohort's answers in batched calls
+        similarities, numeric_grades = self._batch_scores(aligned_by_student)
+        
+        for (student_id, aligned_answers), student_similarities, student_numeric_grades in zip(
+                aligned_by_student, similarities, numeric_grades):
+            try:
+                result = self._grade_aligned_answers(student_id, aligned_answers,
+                                                     student_similarities, student_numeric_grades)
                 results.append(result)
             except Exception as e:
                 logger.error(f"Error grading {student_id}: {e}")
         
         return results
     
-    def generate_report(self, results: List[GradingResult], output_path: str = "grading_report.json"):
-        """Generate comprehensive grading report"""
+    def _batch_scores(self, aligned_by_student: List[Tuple[str, Dict[str, StudentAnswer]]]
+                      ) -> Tuple[List[Dict[str, float]], List[Dict[str, Tuple[float, bool, float]]]]:
+        """Similarities and numeric grades for every aligned answer, split by answer type"""
+        return (self._batch_similarities(aligned_by_student),
+                self._batch_numeric_grades(aligned_by_student))
+    
+    def _batch_numeric_grades(self, aligned_by_student: List[Tuple[str, Dict[str, StudentAnswer]]]
+                              ) -> List[Dict[str, Tuple[float, bool, float]]]:
+        """Compare all parseable numeric answers of a cohort with one vectorized call"""
+        numeric_grades = [{} for _ in aligned_by_student]
+        if not aligned_by_student:
+            return numeric_grades
+        arrays = self._template_arrays()
+        gradable = (arrays['type'] == _ANSWER_TYPE_CODES['numeric']) & ~np.isnan(arrays['expected_num'])
+        slots, student_vals, question_idx = [], [], []
+        
+        for i, (_, aligned_answers) in enumerate(aligned_by_student):
+            for question_id, answer in aligned_answers.items():
+                j = arrays['index'][question_id]
+                if not gradable[j]:
+                    continue
+                # Unparseable answers are left to grade_answer, which reports why
+                try:
+                    student_value = _parse_first_number(answer.extracted_text)
+                except ValueError:
+                    continue
+                if student_value is None:
+                    continue
+                slots.append((i, question_id))
+                student_vals.append(student_value)
+                question_idx.append(j)
+        
+        if slots:
+            idx = np.array(question_idx, dtype=np.intp)
+            correct, earned = grade_numeric_batch(np.array(student_vals, dtype=np.float64),
+                                                  arrays['expected_num'][idx],
+                                                  arrays['tol'][idx],
+                                                  arrays['points'][idx])
+            for (i, question_id), student_value, is_correct, points_earned in zip(
+                    slots, student_vals, correct.tolist(), earned.tolist()):
+                numeric_grades[i][question_id] = (student_value, is_correct, points_earned)
+        
+        return numeric_grades
+    
+    def _batch_similarities(self, aligned_by_student: List[Tuple[str, Dict[str, StudentAnswer]]]
+                            ) -> List[Dict[str, float]]:
+        """Compute similarities for all non-numeric aligned answers with one cpdist call"""
+        similarities = [{} for _ in aligned_by_student]
+        # Uncached (student, expected) pairs -> the (student index, question id) slots they fill
+        pending: Dict[Tuple[str, str], List[Tuple[int, str]]] = {}
+        
+        for i, (_, aligned_answers) in enumerate(aligned_by_student):
+            for question_id, answer in aligned_answers.items():
+                expected_question = self._prepare_question(self.template[question_id])
+                if expected_question.answer_type == 'numeric':
+                    continue
+                pair = self._similarity_pair(answer, expected_question)
+                if pair[0] == pair[1]:
+                    similarities[i][question_id] = 1.0
+                elif pair in self._sim_cache:
+                    similarities[i][question_id] = self._sim_cache[pair]
+                else:
+                    pending.setdefault(pair, []).append((i, question_id))
+        
+        if pending:
+            pairs = list(pending)
+            # Answers are aligned one-to-one with questions, so score pairwise rather than N x M
+            scores = cpdist([p[0] for p in pairs], [p[1] for p in pairs], scorer=_rf_ratio,
+                            score_cutoff=_SIM_CUTOFF, dtype=np.float64, workers=-1)
+            for pair, score in zip(pairs, scores):
+                similarity = float(score) / 100.0
+                self._cache_similarity(pair, similarity)
+                for i, question_id in pending[pair]:
+                    similarities[i][question_id] = similarity
+        
+        return similarities
+    
+    def _report_summary(self, results: List[GradingResult]) -> Dict[str, Any]:
+        """Summary statistics for a grading report"""
         if not results:
-            report = {
-                'summary': {
-                    'total_students': 0,
-                    'average_score': 0.0,
-                    'average_accuracy': 0.0,
-                    'highest_score': 0.0,
-                    'lowest_score': 0.0,
-                    'max_score': 0.0
-                },
-                'student_results': []
-            }
-        else:
-            report = {
-                'summary': {
-                    'total_students': len(results),
-                    'average_score': np.mean([r.total_score for r in results]),
-                    'average_accuracy': np.mean([r.overall_accuracy for r in results]),
-                    'highest_score': max([r.total_score for r in results]),
-                    'lowest_score': min([r.total_score for r in results]),
-                    'max_score': results[0].max_score if results else 0.0
-                },
-                'student_results': [
-                    {
-                        'student_id': r.student_id,
-                        'total_score': r.total_score,
-                        'max_score': r.max_score,
-                        'accuracy': r.overall_accuracy,
-                        'feedback': r.feedback,
-                        'question_details': r.question_results
-                    }
-                    for r in results
-                ]
+            return {
+                'total_students': 0,
+                'average_score': 0.0,
+                'average_accuracy': 0.0,
+                'highest_score': 0.0,
+                'lowest_score': 0.0,
+                'max_score': 0.0
             }
         
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(report, f, indent=2, ensure_ascii=False)
+        # Single pass over the results instead of one list per statistic
+        n = len(results)
+        score_sum = accuracy_sum = 0.0
+        highest = lowest = results[0].total_score
+        for r in results:
+            score_sum += r.total_score
+            accuracy_sum += r.overall_accuracy
+            if r.total_score > highest:
+                highest = r.total_score
+            elif r.total_score < lowest:
+                lowest = r.total_score
+        
+        return {
+            'total_students': n,
+            'average_score': score_sum / n,
+            'average_accuracy': accuracy_sum / n,
+            'highest_score': highest,
+            'lowest_score': lowest,
+            'max_score': results[0].max_score
+        }
+    
+    def _student_report(self, result: GradingResult) -> Dict[str, Any]:
+        """Per-student entry of a grading report"""
+        return {
+            'student_id': result.student_id,
+            'total_score': result.total_score,
+            'max_score': result.max_score,
+            'accuracy': result.overall_accuracy,
+            'feedback': result.feedback,
+            'question_details': result.question_results
+        }
+    
+    def generate_report(self, results: List[GradingResult], output_path: str = "grading_report.json"):
+        """Generate comprehensive grading report"""
+        report = {
+            'summary': self._report_summary(results),
+            'student_results': [self._student_report(r) for r in results]
+        }
+        
+        with open(output_path, 'wb') as f:
+            f.write(orjson.dumps(report, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+                                 | orjson.OPT_SERIALIZE_NUMPY))
         
         logger.info(f"Report saved to {output_path}")
         return report
+    
+    def generate_report_stream(self, results: List[GradingResult],
+                               output_path: str = "grading_report.ndjson") -> Dict[str, Any]:
+        """Write the grading report as NDJSON: the summary, then one line per student.
+        
+        Student records are serialized one at a time, so the full report is never
+        held in memory. Returns the summary.
+        """
+        summary = self._report_summary(results)
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        
+        with open(output_path, 'wb') as f:
+            f.write(orjson.dumps({'summary': summary}, option=option))
+            f.write(b'\n')
+            for r in results:
+                f.write(orjson.dumps(self._student_report(r), option=option))
+                f.write(b'\n')
+        
+        logger.info(f"Report saved to {output_path}")
+        return summary
 
 def main():
     """Main function to demonstrate the grading system"""
@@ -4,168 +4,265 @@ Template Builder for Automated Homework Grading
 Extracts answer key template from teacher's homework OCR results
 """
 
-import json
 import re
+import sys
+import orjson
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, List, Any
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, List, Any, Optional, Set
 from automated_grading_system import Question
 
+try:
+    import ahocorasick  # optional, speeds up keyword scanning
+except ImportError:
+    ahocorasick = None
+
+# Precompiled patterns used on every OCR token
+_CLEAN_RE = re.compile(r'[^\w\s\.\-\+\=\:\/\(\)\[\]\{\}]')
+_NUMERIC_RE = re.compile(r'^[\d\.]+$')
+_HAS_DIGIT_RE = re.compile(r'\d')
+_ANSWER_CHAR_RE = re.compile(r'[\d.]')
+_ONLY_SYMBOLS_RE = re.compile(r'^[\d\.\-\+\=\:\/\(\)\[\]\{\}]+$')
+
+# ASCII characters _CLEAN_RE removes, as a str.translate deletion table
+_ASCII_CLEAN_TABLE = {c: None for c in range(128) if _CLEAN_RE.match(chr(c))}
+
+# Question numbers like "1.", "2." or "(1)", "（2）", etc.
+_QNUM_RE = re.compile(r'(\d+)\.|[（(](\d+)[）)]')
+
+# Specific answer patterns in the teacher's homework, merged into one alternation.
+# More specific alternatives come first so "x=8" is not cut down to "8".
+_ALL_ANSWERS_RE = re.compile(
+    # Text answers
+    r'(?P<text>甲[：:]\d+袋[，,]\s*乙[：:]\d+袋)'  # Chinese text answers
+    # Formula answers
+    r'|(?P<eq>[xX]\s*=\s*[\d\.]+)'  # x = number
+    r'|(?P<ratio>[\d\.]+\s*:\s*[\d\.]+)'  # ratio format
+    # Numeric answers
+    r'|(?P<num>\d+(?:\.\d+)?)'  # Numbers with optional decimals
+)
+
+# Answer type for each alternative of _ALL_ANSWERS_RE
+_ANSWER_GROUP_TYPES = {
+    'text': 'text',
+    'eq': 'formula',
+    'ratio': 'formula',
+    'num': 'numeric',
+}
+
+# Section headers, in priority order when several appear in one token
+_SECTION_NAMES = ('基础练习', '提高练习', '拓展练习')
+# Substrings marking printed question text rather than an answer
+_QUESTION_INDICATORS = ('填空', '解比例', '应用题', '拓展题', '基础练习', '提高练习')
+# Estimated points per section; anything else gets _DEFAULT_POINTS
+_SECTION_POINTS = {'基础练习': 2.0, '提高练习': 4.0, '拓展练习': 6.0}
+_DEFAULT_POINTS = 3.0
+_KEYWORDS = frozenset(_SECTION_NAMES + _QUESTION_INDICATORS)
+# Every keyword has a non-ASCII character, so ASCII-only tokens cannot contain one
+_KEYWORDS_NEED_NON_ASCII = not any(keyword.isascii() for keyword in _KEYWORDS)
+# No keyword's suffix starts another keyword, so non-overlapping findall sees them all
+_KEYWORD_RE = re.compile('|'.join(map(re.escape, sorted(_KEYWORDS))))
+
+# OCR pages repeat many short tokens ("1", "=", section headers, ...), so the
+# pure per-token helpers are memoized; see _clean_text.cache_info()
+@lru_cache(maxsize=4096)
+def _clean_text(text: str) -> str:
+    """Clean OCR text"""
+    # Plain ASCII tokens are common; translate avoids the regex engine for them
+    if text.isascii():
+        return text.translate(_ASCII_CLEAN_TABLE).strip()
+    text = _CLEAN_RE.sub('', text)
+    return text.strip()
+
+@lru_cache(maxsize=4096)
+def _determine_answer_type(text: str) -> str:
+    """Determine the type of answer"""
+    if _NUMERIC_RE.match(text):
+        return 'numeric'
+    elif any(symbol in text for symbol in ['=', ':', '+', '-', '×', '÷']):
+        return 'formula'
+    else:
+        return 'text'
+
+def _build_keyword_automaton():
+    """Aho-Corasick automaton over all keywords, or None without pyahocorasick"""
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for keyword in _KEYWORDS:
+        automaton.add_word(keyword, keyword)
+    automaton.make_automaton()
+    return automaton
+
 class TemplateBuilder:
     """Builds grading template from teacher's answer key"""
     
-    def __init__(self):
+    def __init__(self, verbose: bool = True):
+        self.verbose = verbose
         self.question_patterns = {
-            '填空': r'填空[（(](\d+)[）)]',
-            '解比例': r'解比例[（(](\d+)[）)]',
-            '应用题': r'应用题',
-            '拓展题': r'拓展题'
+            '填空': re.compile(r'填空[（(](\d+)[）)]'),
+            '解比例': re.compile(r'解比例[（(](\d+)[）)]'),
+            '应用题': re.compile(r'应用题'),
+            '拓展题': re.compile(r'拓展题')
         }
+        self._keyword_automaton = _build_keyword_automaton()
     
     def extract_template_from_ocr(self, ocr_result: Dict[str, Any]) -> Dict[str, Question]:
         """Extract question template from teacher's OCR result"""
-        template = {}
+        # Answers are collected column-wise; Question objects are built only for the final template
+        columns = self._new_columns()
         
+        # Only the recognized texts are needed; scores and boxes are ignored
         texts = ocr_result.get('rec_texts', [])
-        scores = ocr_result.get('rec_scores', [])
-        boxes = ocr_result.get('rec_boxes', [])
         
-        # Find question sections and their answers
+        # Clean every token once
+        cleaned = [self._clean_text(text) for text in texts]
+        
+        # Find question sections and their answers in a single pass
         current_section = None
         current_question = None
+        logs = []  # (message, *args), formatted once after the loop
         
-        # First pass: identify sections and questions
-        for i, (text, score, box) in enumerate(zip(texts, scores, boxes)):
-            cleaned_text = self._clean_text(text)
+        for i, cleaned_text in enumerate(cleaned):
+            keywords = self._find_keywords(cleaned_text)
             
             # Identify question sections
-            if self._is_section_header(cleaned_text):
-                current_section = self._extract_section_name(cleaned_text)
-                print(f"Found section: {current_section}")
-                continue
-            
-            # Identify individual questions
-            question_match = self._extract_question_number(cleaned_text)
-            if question_match:
-                current_question = question_match
-                print(f"Found question: {current_question}")
-                continue
-        
-        # Second pass: look for answers with better context
-        # Look for specific answer patterns in the teacher's homework
-        answer_patterns = [
-            # Numeric answers
-            r'(\d+(?:\.\d+)?)',  # Numbers with optional decimals
-            # Formula answers
-            r'([xX]\s*=\s*[\d\.]+)',  # x = number
-            r'([\d\.]+\s*:\s*[\d\.]+)',  # ratio format
-            # Text answers
-            r'(甲[：:]\d+袋[，,]\s*乙[：:]\d+袋)',  # Chinese text answers
-        ]
-        
-        for i, (text, score, box) in enumerate(zip(texts, scores, boxes)):
-            cleaned_text = self._clean_text(text)
+            section = self._match_section(keywords)
+            if section:
+                current_section = section
+                logs.append(("Found section: {}", current_section))
+            else:
+                # Identify individual questions
+                question_match = self._extract_question_number(cleaned_text)
+                if question_match:
+                    current_question = question_match
+                    logs.append(("Found question: {}", current_question))
             
-            # Skip if it's clearly not an answer
-            if self._is_question_text(cleaned_text) or len(cleaned_text) < 1:
+            # Tokens like "1.2" also match a question number, so still look for answers.
+            # Skip if it's clearly not an answer; every answer pattern needs a digit or '.'
+            if not _ANSWER_CHAR_RE.search(cleaned_text) or not keywords.isdisjoint(_QUESTION_INDICATORS):
                 continue
             
             # Check if this looks like an answer using patterns
-            for pattern in answer_patterns:
-                match = re.search(pattern, cleaned_text)
-                if match:
-                    answer_text = match.group(1)
-                    answer_type = self._determine_answer_type(answer_text)
-                    points = self._estimate_points(current_section, str(i))
-                    
-                    question_id = f"Q{i+1}"
-                    template[question_id] = Question(
-                        question_id=question_id,
-                        question_text=f"Question {i+1}",
-                        expected_answer=answer_text,
-                        answer_type=answer_type,
-                        points=points
-                    )
-                    print(f"Extracted answer: {question_id} = {answer_text} ({answer_type})")
-                    break
+            match = _ALL_ANSWERS_RE.search(cleaned_text)
+            if match:
+                answer_text = match.group(match.lastgroup)
+                answer_type = _ANSWER_GROUP_TYPES[match.lastgroup]
+                points = self._estimate_points(current_section, str(i))
+                
+                self._append_answer(columns, i, answer_text, answer_type, points)
+                logs.append(("Extracted answer: Q{} = {} ({})", i + 1, answer_text, answer_type))
+        
+        self._write_logs(logs)
         
         # If we didn't find enough answers, try a simpler approach
-        if len(template) < 3:
-            print("Using fallback answer extraction...")
-            template = self._fallback_answer_extraction(texts, scores, boxes)
+        if len(columns['index']) < 3:
+            if self.verbose:
+                print("Using fallback answer extraction...")
+            return self._fallback_answer_extraction(texts)
         
+        return self._template_from_columns(columns)
+    
+    def _new_columns(self) -> Dict[str, list]:
+        """Empty column buffers for extracted answers, one entry per answer"""
+        return {'index': [], 'expected_answer': [], 'answer_type': [], 'points': []}
+    
+    def _append_answer(self, columns: Dict[str, list], index: int, expected_answer: str,
+                       answer_type: str, points: float):
+        """Record an answer found at OCR token index"""
+        columns['index'].append(index)
+        columns['expected_answer'].append(expected_answer)
+        columns['answer_type'].append(answer_type)
+        columns['points'].append(points)
+    
+    def _template_from_columns(self, columns: Dict[str, list]) -> Dict[str, Question]:
+        """Build the template's Question objects from the column buffers"""
+        template = {}
+        for i, expected_answer, answer_type, points in zip(
+                columns['index'], columns['expected_answer'], columns['answer_type'], columns['points']):
+            question_id = f"Q{i+1}"
+            template[question_id] = Question(
+                question_id=question_id,
+                question_text=f"Question {i+1}",
+                expected_answer=expected_answer,
+                answer_type=answer_type,
+                points=points
+            )
         return template
     
+    def _write_logs(self, logs: List[tuple]):
+        """Print collected progress messages in a single write"""
+        if self.verbose and logs:
+            sys.stdout.write("\n".join(message.format(*args) for message, *args in logs) + "\n")
+    
     def _clean_text(self, text: str) -> str:
         """Clean OCR text"""
-        text = re.sub(r'[^\w\s\.\-\+\=\:\/\(\)\[\]\{\}]', '', text)
-        return text.strip()
+        return _clean_text(text)
+    
+    def _find_keywords(self, text: str) -> Set[str]:
+        """Find all section names and question indicators in text in one scan"""
+        # Most answer tokens are plain ASCII numbers and formulas
+        if _KEYWORDS_NEED_NON_ASCII and text.isascii():
+            return set()
+        if self._keyword_automaton is not None:
+            return {keyword for _, keyword in self._keyword_automaton.iter(text)}
+        return set(_KEYWORD_RE.findall(text))
+    
+    def _match_section(self, keywords: Set[str]) -> Optional[str]:
+        """Section name among the found keywords, if any"""
+        for name in _SECTION_NAMES:
+            if name in keywords:
+                return name
+        return None
     
     def _is_section_header(self, text: str) -> bool:
         """Check if text is a section header"""
-        section_indicators = ['基础练习', '提高练习', '拓展练习']
-        return any(indicator in text for indicator in section_indicators)
+        return self._match_section(self._find_keywords(text)) is not None
     
     def _extract_section_name(self, text: str) -> str:
         """Extract section name from header"""
-        if '基础练习' in text:
-            return '基础练习'
-        elif '提高练习' in text:
-            return '提高练习'
-        elif '拓展练习' in text:
-            return '拓展练习'
-        return '未知'
-    
-    def _extract_question_number(self, text: str) -> str:
+        return self._match_section(self._find_keywords(text)) or '未知'
+    
+    def _is_question_text(self, text: str) -> bool:
+        """Check if text appears to be question text rather than answer"""
+        return not self._find_keywords(text).isdisjoint(_QUESTION_INDICATORS)
+    
+    def _extract_question_number(self, text: str) -> Optional[str]:
         """Extract question number from text"""
-        # Look for patterns like "1.", "2.", "(1)", "(2)", etc.
-        patterns = [
-            r'(\d+)\.',  # 1., 2., etc.
-            r'[（(](\d+)[）)]',  # (1), (2), etc.
-            r'（(\d+)）',  # （1）, （2）, etc.
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, text)
-            if match:
-                return match.group(1)
-        
+        match = _QNUM_RE.search(text)
+        if match:
+            return match.group(1) or match.group(2)
         return None
     
     def _looks_like_answer(self, text: str) -> bool:
         """Check if text looks like an answer"""
         # Look for numbers, mathematical symbols, or short responses
-        if re.match(r'^[\d\.\-\+\=\:\/\(\)\[\]\{\}]+$', text):
+        if _ONLY_SYMBOLS_RE.match(text):
             return True
-        if len(text) <= 15 and any(char.isdigit() for char in text):
+        if len(text) <= 15 and _HAS_DIGIT_RE.search(text):
             return True
         return False
     
     def _determine_answer_type(self, text: str) -> str:
         """Determine the type of answer"""
-        if re.match(r'^[\d\.]+$', text):
-            return 'numeric'
-        elif any(symbol in text for symbol in ['=', ':', '+', '-', '×', '÷']):
-            return 'formula'
-        else:
-            return 'text'
+        return _determine_answer_type(text)
     
     def _estimate_points(self, section: str, question: str) -> float:
         """Estimate points based on section and question type"""
-        if section == '基础练习':
-            return 2.0
-        elif section == '提高练习':
-            return 4.0
-        elif section == '拓展练习':
-            return 6.0
-        else:
-            return 3.0
-    
-    def _fallback_answer_extraction(self, texts, scores, boxes):
+        return _SECTION_POINTS.get(section, _DEFAULT_POINTS)
+    
+    def _fallback_answer_extraction(self, texts: List[str]) -> Dict[str, Question]:
         """Fallback method to extract answers when pattern matching fails"""
-        template = {}
+        columns = self._new_columns()
+        logs = []
         
         # Look for standalone numbers and short answers
-        for i, (text, score, box) in enumerate(zip(texts, scores, boxes)):
+        for i, text in enumerate(texts):
+            # Cheap early out: tokens without digits are prose or stray symbols
+            if not _HAS_DIGIT_RE.search(text):
+                continue
+            
             cleaned_text = self._clean_text(text)
             
             # Skip long text or question text
@@ -177,42 +274,88 @@ class TemplateBuilder:
                 answer_type = self._determine_answer_type(cleaned_text)
                 points = 3.0  # Default points
                 
-                question_id = f"Q{i+1}"
-                template[question_id] = Question(
-                    question_id=question_id,
-                    question_text=f"Question {i+1}",
-                    expected_answer=cleaned_text,
-                    answer_type=answer_type,
-                    points=points
-                )
-                print(f"Fallback extracted: {question_id} = {cleaned_text} ({answer_type})")
+                self._append_answer(columns, i, cleaned_text, answer_type, points)
+                logs.append(("Fallback extracted: Q{} = {} ({})", i + 1, cleaned_text, answer_type))
         
-        return template
+        self._write_logs(logs)
+        return self._template_from_columns(columns)
     
     def save_template(self, template: Dict[str, Question], output_path: str):
         """Save template to JSON file"""
-        template_data = {}
-        for q_id, question in template.items():
-            template_data[q_id] = {
-                'question_id': question.question_id,
-                'question_text': question.question_text,
-                'expected_answer': question.expected_answer,
-                'answer_type': question.answer_type,
-                'points': question.points,
-                'tolerance': question.tolerance,
-                'partial_credit': question.partial_credit
-            }
-        
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(template_data, f, indent=2, ensure_ascii=False)
+        # Write one question at a time rather than building the whole document first;
+        # the layout matches json.dump(indent=2, ensure_ascii=False)
+        with open(output_path, 'wb') as f:
+            if not template:
+                f.write(b'{}')
+            for i, (q_id, question) in enumerate(template.items()):
+                f.write(b',\n  ' if i else b'{\n  ')
+                f.write(orjson.dumps(q_id))
+                f.write(b': ')
+                f.write(orjson.dumps({
+                    'question_id': question.question_id,
+                    'question_text': question.question_text,
+                    'expected_answer': question.expected_answer,
+                    'answer_type': question.answer_type,
+                    'points': question.points,
+                    'tolerance': question.tolerance,
+                    'partial_credit': question.partial_credit
+                }, option=orjson.OPT_INDENT_2).replace(b'\n', b'\n  '))
+            if template:
+                f.write(b'\n}')
         
         print(f"Template saved to {output_path}")
 
+def load_ocr_texts(path: str) -> Dict[str, Any]:
+    """Load the part of an OCR result file that template extraction uses"""
+    # A full orjson parse beats streaming out rec_texts; only the texts are kept
+    with open(path, 'rb') as f:
+        ocr_result = orjson.loads(f.read())
+    return {'rec_texts': ocr_result.get('rec_texts', [])}
+
+def build_template_for_file(path: str) -> Dict[str, Question]:
+    """Extract a template from one OCR result file; top-level so worker processes can run it"""
+    return TemplateBuilder(verbose=False).extract_template_from_ocr(load_ocr_texts(path))
+
+def build_templates(paths: List[str]) -> Dict[str, Dict[str, Question]]:
+    """Extract templates from several OCR result files in parallel worker processes.
+    
+    Returns the templates by path; files that cannot be read or parsed are reported and skipped.
+    """
+    if len(paths) <= 1:
+        # A worker process is not worth starting for one file
+        return _collect_templates(paths, [None] * len(paths))
+    with ProcessPoolExecutor() as executor:
+        futures = [executor.submit(build_template_for_file, path) for path in paths]
+        return _collect_templates(paths, futures)
+
+def _collect_templates(paths: List[str], futures: List[Optional[Future]]) -> Dict[str, Dict[str, Question]]:
+    """Templates of the files that built successfully; a None future builds in-process"""
+    templates = {}
+    for path, future in zip(paths, futures):
+        try:
+            templates[path] = future.result() if future else build_template_for_file(path)
+        except Exception as e:
+            print(f"Error building template from {path}: {e}", file=sys.stderr)
+    return templates
+
 def main():
     """Extract template from teacher's homework"""
+    # Arguments, if given, are OCR result files or directories of them to process in parallel
+    if len(sys.argv) > 1:
+        paths = []
+        for arg in sys.argv[1:]:
+            arg_path = Path(arg)
+            paths.extend(sorted(map(str, arg_path.glob("*_res.json"))) if arg_path.is_dir() else [arg])
+        
+        builder = TemplateBuilder()
+        for path, template in build_templates(paths).items():
+            output_path = Path(path).with_name(Path(path).stem.replace("_res", "") + "_template.json")
+            builder.save_template(template, str(output_path))
+            print(f"Extracted {len(template)} questions from {path}")
+        return
+    
     # Load teacher's OCR result
-    with open('output/homework1_res.json', 'r', encoding='utf-8') as f:
-        teacher_ocr = json.load(f)
+    teacher_ocr = load_ocr_texts('output/homework1_res.json')
     
     # Build template
     builder = TemplateBuilder()